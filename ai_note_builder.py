@@ -3,35 +3,63 @@ File: ai_note_builder.py
 Uses Claude AI to generate note sequences for known songs.
 """
 
+import difflib
+import functools
 import json
+import re
+import time
+import unicodedata
 import anthropic
-from typing import List, Tuple
+from pathlib import Path
+from typing import List, Optional, Tuple
 from tine import Tine
+from cache import cache_key, cache_path, write_atomically
 
-def get_notes_from_text(song_description: str, duration: float) -> List[Tuple[float, str]]:
+MODEL = "claude-3-5-sonnet-20241022"
+
+# Bump whenever the prompt template changes to invalidate cached responses
+PROMPT_VERSION = "v4"
+
+# Minimum difflib similarity for two descriptions to share a cached response
+SIMILARITY_CUTOFF = 0.92
+
+# Words that may be added to or left out of a description without it naming
+# a different song, e.g. "fur elise" vs "beethoven fur elise"
+FILLER_WORDS = frozenset({
+    "by", "the", "from", "song", "tune", "melody", "theme",
+    "bach", "beethoven", "brahms", "chopin", "debussy", "handel", "mozart",
+    "schubert", "tchaikovsky", "vivaldi", "traditional",
+})
+
+# Words that pick out a key, movement or numbered work. Descriptions that
+# differ in any of these, or in any word with a digit, never share a cached
+# response, e.g. "symphony no 5" vs "symphony no 9"
+KEY_WORDS = frozenset("abcdefg") | {"major", "minor", "sharp", "flat", "key"}
+MOVEMENT_WORDS = frozenset({
+    "movement", "mvt", "part", "act", "no", "op", "opus",
+    "first", "second", "third", "fourth", "fifth",
+})
+
+# Sorted once at import
+AVAILABLE_NOTES = tuple(sorted(Tine.NOTES))
+AVAILABLE_NOTES_STR = ', '.join(AVAILABLE_NOTES)
+AVAILABLE_NOTES_SET = frozenset(AVAILABLE_NOTES)  # for fast validation lookups
+
+SYSTEM_TEXT = "You are a musical expert specializing in mechanical music boxes. You understand their physical limitations and how to arrange music appropriately for them."
+
+
+def _build_prompt(song_description: str, duration: float) -> str:
     """
-    Ask Claude to generate a sequence of notes and timings for a given song description.
-    
-    Args:
-        song_description: Name or description of the song
-        duration: Target duration in seconds
-        
-    Returns:
-        List of (time_in_sec, note_name) tuples
+    Builds the note request for one song.
     """
-    client = anthropic.Anthropic()
-    
-    # Get available notes from Tine class
-    available_notes = sorted(Tine().notes)
-    
-    prompt = f"""
+    return f"""
     I need you to provide musical notes and timing for a mechanical music box that will play "{song_description}".
 
     Important context:
     - This is for a physical music box with metal tines that are plucked by pins on a rotating cylinder
     - The cylinder takes exactly {duration} seconds for one complete rotation
-    - The music box only has these available notes: {', '.join(available_notes)}, do not use any other notes.
-      Nothing below {available_notes[0]} and nothing above {available_notes[-1]}.
+    - The music box only has these available notes: {AVAILABLE_NOTES_STR}, do not use any other notes.
+      Nothing below {AVAILABLE_NOTES[0]} and nothing above {AVAILABLE_NOTES[-1]}.
     - If the song requires notes that aren't available (like sharps or flats), transpose it to a key that works with these notes
     - The notes must be spaced far enough apart to allow the tines to resonate (minimum 0.15 seconds between same note)
     - Music boxes can play multiple notes simultaneously for chords or richer arrangements
@@ -61,54 +89,331 @@ def get_notes_from_text(song_description: str, duration: float) -> List[Tuple[fl
     
     Important: The "thinking" field must be a single line with no line breaks or special characters.
     """
-    
+
+
+@functools.cache
+def _get_client() -> anthropic.Anthropic:
+    """
+    Returns a shared client so repeated requests reuse its connection pool.
+    """
+    return anthropic.Anthropic()
+
+
+def _normalise_description(song_description: str) -> str:
+    """
+    Reduce a description to lowercase ASCII words so that e.g. "Für Elise!"
+    and "fur elise" map to the same cache entry.
+    """
+    decomposed = unicodedata.normalize("NFKD", song_description)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", stripped.casefold()))
+
+
+def _bucket_key(duration: float) -> str:
+    """
+    Hash everything except the song that determines Claude's answer.
+    Only cache entries in the same bucket are considered for near matches.
+    """
+    return cache_key(round(duration, 3), AVAILABLE_NOTES, MODEL, PROMPT_VERSION)
+
+
+def _cache_key(song_description: str, duration: float) -> str:
+    return cache_key(_normalise_description(song_description), _bucket_key(duration))
+
+
+def _qualifiers(words: set) -> set:
+    """
+    Returns the words that tell apart keys, movements or numbered works.
+    """
+    return {
+        w for w in words
+        if w in KEY_WORDS or w in MOVEMENT_WORDS or any(c.isdigit() for c in w)
+    }
+
+
+def _same_qualifiers(description: str, candidate: str) -> bool:
+    return _qualifiers(set(description.split())) == _qualifiers(set(candidate.split()))
+
+
+def _filler_match(description: str, candidates) -> Optional[str]:
+    """
+    Returns the candidate that differs from description only by added
+    FILLER_WORDS, e.g. "fur elise" and "beethoven fur elise". Extra words of any
+    other kind ("star wars" vs "star wars imperial march") name a different
+    song, so they never match. Nor do numbered works, where a composer's name
+    does matter ("symphony no 5" vs "mozart symphony no 5").
+    """
+    words = set(description.split())
+    if _qualifiers(words):
+        return None
+    best = None
+    for candidate in candidates:
+        other = set(candidate.split())
+        if not (words <= other or other <= words):
+            continue
+        if (words ^ other) - FILLER_WORDS or not (words & other) - FILLER_WORDS:
+            continue
+        rank = (len(words ^ other), candidate)
+        best = min(best, rank) if best else rank
+    return best[1] if best else None
+
+
+def _find_similar_cached(song_description: str, duration: float) -> Optional[Tuple[Path, str]]:
+    """
+    Look for a cached response to a slightly differently worded description
+    of the same song, either a near-identical spelling, e.g. "twinkle twinkle
+    little star" vs "twinkle twinkle litle star", or the same words with
+    FILLER_WORDS added, e.g. "fur elise" vs "Beethoven Für Elise". Descriptions
+    that differ in a number, key or movement are never matched.
+
+    Returns:
+        The cached response file and the description it was cached under
+    """
+    index = _read_index(cache_path("notes", "index.json"))
+    if index is None:
+        return None
+
+    bucket = _bucket_key(duration)
+    candidates = {
+        entry["description"]: key
+        for key, entry in index.items()
+        if entry["bucket"] == bucket
+    }
+    description = _normalise_description(song_description)
+    matches = [
+        m for m in difflib.get_close_matches(description, candidates, n=3, cutoff=SIMILARITY_CUTOFF)
+        if _same_qualifiers(description, m)
+    ]
+    match = matches[0] if matches else _filler_match(description, candidates)
+    if match is None:
+        return None
+    path = cache_path("notes", f"{candidates[match]}.json")
+    return (path, match) if path.exists() else None
+
+
+def _find_cached(song_description: str, duration: float) -> Optional[Tuple[Path, str]]:
+    """
+    Returns the cached response file for this song, if any, and the
+    description it was cached under.
+    """
+    path = cache_path("notes", f"{_cache_key(song_description, duration)}.json")
+    if path.exists():
+        return path, _normalise_description(song_description)
+    return _find_similar_cached(song_description, duration)
+
+
+def _report_cached(song_description: str, cached_description: str):
+    """
+    Says which cached response is being reused, so a near match to the wrong
+    song is visible.
+    """
+    if cached_description == _normalise_description(song_description):
+        print(f"Using cached notes for '{song_description}'")
+    else:
+        print(f"Using cached notes for '{cached_description}' for '{song_description}' "
+              f"(pass --no-cache to ask again)")
+
+
+def _store_cached(song_description: str, duration: float, note_events: List[Tuple[float, str]]):
+    key = _cache_key(song_description, duration)
+    _write_json(cache_path("notes", f"{key}.json"), note_events)
+
+    index_path = cache_path("notes", "index.json")
+    index = _read_index(index_path) or {}
+    index[key] = {
+        "description": _normalise_description(song_description),
+        "bucket": _bucket_key(duration)
+    }
+    _write_json(index_path, index, indent=2)
+
+
+def _write_json(path: Path, data, **kwargs):
+    write_atomically(path, lambda tmp_path: Path(tmp_path).write_text(json.dumps(data, **kwargs)))
+
+
+def _read_index(index_path: Path) -> Optional[dict]:
+    """
+    Returns the description index, or None if there is none yet. An
+    unreadable index (e.g. left by an older, non-atomic write) is treated as
+    missing and rebuilt as songs are cached again.
+    """
+    if not index_path.exists():
+        return None
     try:
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=2000,
-            temperature=0,
-            system="You are a musical expert specializing in mechanical music boxes. You understand their physical limitations and how to arrange music appropriately for them.",
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }]
-        )
+        return json.loads(index_path.read_text())
+    except json.JSONDecodeError:
+        return None
+
+
+def get_notes_from_text(song_description: str, duration: float, use_cache: bool = True) -> List[Tuple[float, str]]:
+    """
+    Ask Claude to generate a sequence of notes and timings for a given song description.
+    Responses are cached on disk, so regenerating the same (or a near-identically
+    described) song is free.
+    
+    Args:
+        song_description: Name or description of the song
+        duration: Target duration in seconds
+        use_cache: If False, ignore any cached response and ask Claude again
+        
+    Returns:
+        List of (time_in_sec, note_name) tuples
+    """
+    cached = _find_cached(song_description, duration) if use_cache else None
+    if cached:
+        path, cached_description = cached
+        _report_cached(song_description, cached_description)
+        return json.loads(path.read_text())
+
+    note_events = _request_notes(song_description, duration)
+    if note_events:
+        _store_cached(song_description, duration, note_events)
+    return note_events
+
+
+def _request_params(song_description: str, duration: float) -> dict:
+    """
+    Builds the Messages API parameters for one song. Shared by the online and
+    batch paths so both send the same request.
+    """
+    return {
+        "model": MODEL,
+        "max_tokens": 2000,
+        "temperature": 0,
+        "system": SYSTEM_TEXT,
+        "messages": [{
+            "role": "user",
+            "content": _build_prompt(song_description, duration)
+        }]
+    }
+
+
+def _parse_notes(response: str, duration: float) -> List[Tuple[float, str]]:
+    """
+    Parse and validate Claude's JSON response.
+    Raises ValueError if the response is truncated or malformed.
+    """
+    print(response)
+    
+    # Check if response appears to be truncated
+    if not response.strip().endswith('}'):
+        raise ValueError("Response appears to be truncated")
         
-        # Extract JSON from response
-        response = message.content[0].text
+    try:
+        parsed = json.loads(response)
+    except json.JSONDecodeError as e:
+        print("Raw response:")
         print(response)
+        raise ValueError(f"JSON parsing error: {e}")
         
-        # Check if response appears to be truncated
-        if not response.strip().endswith('}'):
-            raise ValueError("Response appears to be truncated")
-            
-        try:
-            parsed = json.loads(response)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            print("Raw response:")
-            print(response)
-            return []
+    note_events = parsed['notes']
+    
+    # Validate format and notes
+    if not isinstance(note_events, list):
+        raise ValueError("Response is not a list")
+    
+    for event in note_events:
+        if not isinstance(event, list) or len(event) != 2:
+            raise ValueError("Invalid event format")
+        if not isinstance(event[0], (int, float)) or not isinstance(event[1], str):
+            raise ValueError("Invalid event types")
+        if event[1] not in AVAILABLE_NOTES_SET:
+            raise ValueError(f"Invalid note: {event[1]}")
+        if event[0] < 0 or event[0] > duration:
+            raise ValueError(f"Time out of range: {event[0]}")
             
-        note_events = parsed['notes']
-        
-        # Validate format and notes
-        if not isinstance(note_events, list):
-            raise ValueError("Response is not a list")
-        
-        valid_notes = set(available_notes)  # for faster lookups
-        for event in note_events:
-            if not isinstance(event, list) or len(event) != 2:
-                raise ValueError("Invalid event format")
-            if not isinstance(event[0], (int, float)) or not isinstance(event[1], str):
-                raise ValueError("Invalid event types")
-            if event[1] not in valid_notes:
-                raise ValueError(f"Invalid note: {event[1]}")
-            if event[0] < 0 or event[0] > duration:
-                raise ValueError(f"Time out of range: {event[0]}")
-                
-        return note_events
+    return note_events
+
+
+def _request_notes(song_description: str, duration: float) -> List[Tuple[float, str]]:
+    """
+    Stream the note request from Claude and validate the response. The stream
+    is abandoned early if the response does not start as JSON.
+    Returns an empty list on any failure.
+    """
+    client = _get_client()
+    
+    try:
+        chunks = []
+        checked_start = False
+        with client.messages.stream(**_request_params(song_description, duration)) as stream:
+            for text in stream.text_stream:
+                chunks.append(text)
+                if not checked_start and text.strip():
+                    # Bail out as soon as the response is clearly not our JSON,
+                    # rather than waiting for the whole generation to finish
+                    start = "".join(chunks).lstrip()
+                    if not start.startswith('{'):
+                        raise ValueError(f"Response is not JSON: {start[:80]!r}")
+                    checked_start = True
+        return _parse_notes("".join(chunks), duration)
         
     except Exception as e:
         print(f"Error getting notes from AI: {e}")
-        return [] 
\ No newline at end of file
+        return []
+
+
+def get_notes_from_text_batch(
+    requests: List[Tuple[str, float]],
+    use_cache: bool = True,
+    poll_interval: float = 5.0
+) -> List[List[Tuple[float, str]]]:
+    """
+    Generate notes for several songs at once using the Message Batches API,
+    which costs half as much as individual requests but may take minutes.
+    
+    Args:
+        requests: List of (song_description, duration) pairs
+        use_cache: If False, ignore any cached responses and ask Claude again
+        poll_interval: Seconds between batch status checks
+        
+    Returns:
+        One list of (time_in_sec, note_name) tuples per request, in order.
+        Failed requests yield an empty list.
+    """
+    if len(requests) == 1:
+        return [get_notes_from_text(*requests[0], use_cache=use_cache)]
+
+    results = [[] for _ in requests]
+    pending = []
+    for i, (song_description, duration) in enumerate(requests):
+        cached = _find_cached(song_description, duration) if use_cache else None
+        if cached:
+            path, cached_description = cached
+            _report_cached(song_description, cached_description)
+            results[i] = json.loads(path.read_text())
+        else:
+            pending.append(i)
+
+    if not pending:
+        return results
+
+    client = _get_client()
+    try:
+        batch = client.messages.batches.create(requests=[
+            {"custom_id": str(i), "params": _request_params(*requests[i])}
+            for i in pending
+        ])
+        print(f"Submitted batch {batch.id} with {len(pending)} songs")
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = client.messages.batches.retrieve(batch.id)
+
+        for entry in client.messages.batches.results(batch.id):
+            i = int(entry.custom_id)
+            song_description, duration = requests[i]
+            if entry.result.type != "succeeded":
+                print(f"Batch request for '{song_description}' {entry.result.type}")
+                continue
+            try:
+                results[i] = _parse_notes(entry.result.message.content[0].text, duration)
+            except Exception as e:
+                print(f"Error getting notes for '{song_description}': {e}")
+                continue
+            if results[i]:
+                _store_cached(song_description, duration, results[i])
+
+    except Exception as e:
+        print(f"Error running note batch: {e}")
+
+    return results
@@ -0,0 +1,111 @@
+"""
+File: cache.py
+Locations of the on-disk caches shared by the music box tools.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# Root of all persistent caches (respects XDG_CACHE_HOME if set)
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "music-box"
+
+# Cached solids are keyed on the source of the module that builds them, so
+# bump this only for changes that source does not show, e.g. a CadQuery or
+# cq_gears upgrade that alters the geometry
+SOLID_CACHE_VERSION = "v1"
+
+_solid_cache = {}
+
+
+def cache_path(*parts: str) -> Path:
+    """
+    Returns a path inside the cache directory, creating its parent directory.
+
+    Args:
+        parts: Path components below the cache root, e.g. ("notes", "abc.json").
+    """
+    path = CACHE_DIR.joinpath(*parts)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_atomically(path: Path, write):
+    """
+    Writes a cache file through a temporary file next to it, moved into place
+    only once complete, so an interrupted write never leaves a truncated entry.
+
+    Args:
+        path: Final location of the file.
+        write: Callable taking the temporary file's path (a str) and writing
+            the file there; it should raise if the write fails.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def cache_key(*key_data) -> str:
+    """
+    Returns a short stable hash of JSON-serialisable key data, for use in
+    cache file names.
+    """
+    encoded = json.dumps(list(key_data), sort_keys=True).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+@functools.cache
+def source_hash(file_name: str) -> str:
+    """
+    Returns a hash of a source file, so that anything built by its code,
+    including literals inside methods, is rebuilt once the code changes.
+    """
+    return hashlib.blake2b(Path(file_name).read_bytes(), digest_size=16).hexdigest()
+
+
+def cached_solid(name: str, params: dict, build, source: str, use_cache: bool = True, memoise: bool = True):
+    """
+    Returns build(), memoised in memory and as a BREP file in the disk cache,
+    so solids that only depend on fixed geometry are built once.
+
+    Args:
+        name: Name of the solid, used in the cache file name.
+        params: Every parameter the solid depends on.
+        build: Callable returning the solid as a cq.Shape.
+        source: Path of the module that builds the solid (its __file__).
+        use_cache: If False, ignore any cached copy and rebuild the solid,
+            replacing the cached one.
+        memoise: If False, only cache the solid on disk. Use this for solids
+            that differ per song, which would otherwise be held in memory for
+            the life of the process.
+    """
+    # Imported here so the audio-only tools do not load CadQuery
+    import cadquery as cq
+
+    key = cache_key(name, params, source_hash(source), SOLID_CACHE_VERSION)
+    if use_cache and key in _solid_cache:
+        return _solid_cache[key]
+
+    path = cache_path("solids", f"{name}_{key}.brep")
+    if use_cache and path.exists():
+        solid = cq.Shape.importBrep(str(path))
+    else:
+        solid = build()
+        write_atomically(path, lambda tmp_path: _export_brep(solid, tmp_path))
+
+    if memoise:
+        _solid_cache[key] = solid
+    return solid
+
+
+def _export_brep(solid, file_name: str):
+    if not solid.exportBrep(file_name):
+        raise OSError(f"Could not write '{file_name}'")
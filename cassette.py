@@ -4,10 +4,42 @@ Generates a 3D cassette wheel for a music box, using pin placement
 based on incoming note/timing data.
 """
 
+import bisect
+import functools
 import math
+import shutil
+import numpy as np
 import cadquery as cq
-import cq_gears
+from OCP.BOPAlgo import BOPAlgo_Options
+from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.BRepTools import BRepTools
+from OCP.OSD import OSD_Parallel
+from OCP.StlAPI import StlAPI_Writer
 from tine import Tine
+from cache import SOLID_CACHE_VERSION, cache_key, cache_path, cached_solid, source_hash, write_atomically
+
+# Let OCCT spread boolean operations over all cores. cadquery already asks
+# for parallel runs on the booleans it builds; this sets the default for any
+# other BOPAlgo-based operation and lets OCCT use its own thread pool
+BOPAlgo_Options.SetParallelMode_s(True)
+OSD_Parallel.SetUseOcctThreads_s(True)
+
+# Bump whenever STL meshing changes to invalidate the cached exports
+STL_CACHE_VERSION = "v2"
+
+# Geometry attributes the top assembly is built from; it does not depend on the song
+TOP_ASSEMBLY_PARAMS = (
+    "base_ring_height", "cassette_total_height",
+    "lower_circle_height", "lower_circle_diam",
+    "big_cog_height", "big_cog_base_diam", "big_cog_teeth_diam", "big_cog_num_teeth",
+    "small_cog_height", "small_cog_base_diam", "small_cog_teeth_diam", "small_cog_num_teeth",
+    "top_circle_height", "top_circle_diam"
+)
+
+
+def _write_stl(writer: StlAPI_Writer, shape, file_name: str):
+    if not writer.Write(shape, file_name):
+        raise OSError(f"Could not write '{file_name}'")
 
 
 class CassetteCAD:
@@ -17,17 +49,32 @@ class CassetteCAD:
     pass in an existing list of (time_in_sec, note_name).
 
     Public Methods:
-        __init__(note_events, rotation_duration=20.0): Initialize geometry data and build the cassette.
+        __init__(note_events, rotation_duration=20.0, fuse=True, use_cache=True): Initialize geometry data and build the cassette.
         export(filename: str): Exports the cassette as an STL file.
         get_assembly(): Access the underlying CadQuery assembly (for advanced usage).
+        pin_count(): Number of pins the cassette will have, without building it.
+
+    The geometry is built on first use by export() or get_assembly().
     """
 
-    def __init__(self, note_events, rotation_duration=20.0):
+    def __init__(self, note_events, rotation_duration=20.0, fuse=True, use_cache=True):
         """
         Args:
             note_events: A list of (time_in_sec, note_name) tuples.
             rotation_duration: How long (seconds) the cassette rotation takes.
+            fuse: If True, fuse the body, pins, base ring and top assembly in
+                one boolean, which merges the parts that share faces. Pins and
+                cog teeth only touch the cylinders along tangent lines, so they
+                stay separate solids and the result is still a compound of
+                touching solids (slicers merge them on import). If False, that
+                boolean is skipped, which is faster and gives nearly the same
+                compound.
+            use_cache: If False, rebuild the cassette and top assembly
+                instead of reading them from the solid cache, and mesh the
+                STL instead of copying a cached export.
         """
+        self.fuse = fuse
+        self._use_cache = use_cache
         # Pin/tine geometry
         self.tine_notes = Tine().notes
         self.total_tines = len(self.tine_notes)
@@ -92,15 +139,56 @@ class CassetteCAD:
         # Store the incoming note events
         self.note_events = note_events
 
-        # Build the geometry
-        self._pins = self._generate_pins_from_notes()
-        self._assembly = self._build_cassette()
-
-    def export(self, filename: str):
+        # Structure-of-arrays view of the playable events, sorted by time:
+        # event times and the tine index each one plucks (unknown notes dropped)
+        self._note_to_index = {note: i for i, note in enumerate(self.tine_notes)}
+        playable = [
+            (time_sec, self._note_to_index[note_name])
+            for time_sec, note_name in note_events
+            if note_name in self._note_to_index
+        ]
+        times = np.array([time_sec for time_sec, _ in playable], dtype=float)
+        note_idx = np.array([index for _, index in playable], dtype=np.int8)
+        order = np.argsort(times, kind="stable")
+        self._times = times[order]
+        self._note_idx = note_idx[order]
+
+    def export(self, filename: str, tolerance: float = 0.01, angular_tolerance: float = 0.1):
         """
         Exports the cassette as an STL file with the specified filename.
+        The assembly is meshed by OCCT in parallel and written as binary STL.
+
+        Args:
+            filename: Path of the STL file to write.
+            tolerance: Linear deflection of the mesh, relative to each edge's size.
+            angular_tolerance: Maximum angle (radians) between adjacent mesh
+                segments. Larger values give far fewer triangles on the
+                cylinders, at the cost of faceting them.
         """
-        self._assembly.val().exportStl(filename, tolerance=0.01)
+        # The same song exported at the same settings (the usual CLI
+        # workflow) is copied from the disk cache, without loading or
+        # meshing the solid at all
+        key = cache_key(
+            self._geometry_params(), tolerance, angular_tolerance,
+            source_hash(__file__), SOLID_CACHE_VERSION, STL_CACHE_VERSION
+        )
+        path = cache_path("stl", f"cassette_{key}.stl")
+        if not self._use_cache or not path.exists():
+            shape = self._assembly.val().wrapped
+
+            # OCCT keeps any finer triangulation already on the shape (e.g.
+            # from an earlier export of this cassette), so clear it to mesh
+            # at exactly the requested settings
+            BRepTools.Clean_s(shape)
+            BRepMesh_IncrementalMesh(shape, tolerance, True, angular_tolerance, True)
+
+            # Only a mesh built at these settings is cached, and only once
+            # it has been written out completely
+            writer = StlAPI_Writer()
+            writer.ASCIIMode = False
+            write_atomically(path, lambda tmp_path: _write_stl(writer, shape, tmp_path))
+
+        shutil.copyfile(path, filename)
         print(f"Exported '{filename}'")
 
     def get_assembly(self):
@@ -109,101 +197,209 @@ class CassetteCAD:
         """
         return self._assembly
 
-    def _generate_pins_from_notes(self) -> cq.Workplane:
+    def pin_count(self) -> int:
         """
-        Create a set of pins based on note events, skipping overlapping pins
-        for the same note if they occur too close in angle.
+        Returns how many pins the cassette will have after the spacing filter,
+        without building any geometry.
         """
-        if not self.note_events:
-            print("Warning: No notes detected to generate pins from.")
-            return cq.Workplane("XY").box(0.0001, 0.0001, 0.0001)
+        return len(self._pin_placements()[0])
+
+    @functools.cached_property
+    def _pins(self) -> cq.Workplane:
+        return self._generate_pins_from_notes()
+
+    @functools.cached_property
+    def _assembly(self) -> cq.Workplane:
+        # Regenerating the same song (the usual CLI workflow) reuses the cached solid
+        cassette = cached_solid(
+            "cassette", self._geometry_params(), lambda: self._build_cassette().val(), __file__,
+            use_cache=self._use_cache, memoise=False
+        )
+        return cq.Workplane("XY").newObject([cassette])
 
-        pins = cq.Workplane("XY")
-        z_min = self.base_ring_height + self.pin_vertical_offset
-        centre_offset = self.pin_width / 2.0
+    def _geometry_params(self) -> dict:
+        """
+        Every geometry setting and the playable events, which together
+        determine the cassette solid.
+        """
+        params = {
+            name: value for name, value in vars(self).items()
+            if isinstance(value, (int, float)) and not name.startswith("_")
+        }
+        params["tine_notes"] = list(self.tine_notes)
+        params["times"] = self._times.tolist()
+        params["note_idx"] = self._note_idx.tolist()
+        return params
+
+    def _spaced_pin_mask(self, angles_deg: np.ndarray) -> np.ndarray:
+        """
+        Mask of the events that get a pin: on each tine, an event is dropped if
+        it falls within min_note_angle_spacing of a pin already kept on that
+        tine, measured around the cassette (so across the 0/360 degree seam and
+        between laps of a song longer than one rotation).
 
-        last_note_angle = {}  # note_name -> angle_in_degrees
+        Args:
+            angles_deg: Angle of every event, in the same (time) order as self._note_idx.
 
-        for time_sec, note_name in self.note_events:
-            if note_name not in self.tine_notes:
-                # Skip unknown note
-                continue
+        Returns:
+            Boolean mask over the events.
+        """
+        keep = np.ones(len(angles_deg), dtype=bool)
+        if not len(angles_deg):
+            return keep
+        wrapped = np.mod(angles_deg, 360.0)
+
+        # Group events by tine and sort each group by position on the cassette
+        order = np.lexsort((wrapped, self._note_idx))
+        sorted_notes = self._note_idx[order]
+        sorted_angles = wrapped[order]
+        same_tine = sorted_notes[1:] == sorted_notes[:-1]
+        too_close = same_tine & (np.diff(sorted_angles) < self.min_note_angle_spacing)
+
+        # Gap between each tine's last and first pin, across the seam
+        first = np.concatenate(([True], ~same_tine))
+        last = np.concatenate((~same_tine, [True]))
+        seam_gap = sorted_angles[first] + 360.0 - sorted_angles[last]
+        too_close_at_seam = seam_gap < self.min_note_angle_spacing
+
+        # Most tines have no close pairs and keep every pin. Whether an event is
+        # dropped depends on the pins *kept* before it, so tines with close pairs
+        # are resolved in time order, keeping their pin angles sorted so only
+        # the two neighbours either side of a new pin need checking
+        crowded = np.union1d(sorted_notes[1:][too_close], sorted_notes[first][too_close_at_seam])
+
+        # Events sorted by (tine, time), so each crowded tine is one slice
+        by_tine_and_time = np.argsort(self._note_idx, kind="stable")
+        tine_bounds = np.searchsorted(self._note_idx[by_tine_and_time], [crowded, crowded + 1])
+
+        for start, end in zip(*tine_bounds.tolist()):
+            positions = by_tine_and_time[start:end]
+            kept_angles = []
+            for position, angle_deg in zip(positions.tolist(), wrapped[positions].tolist()):
+                i = bisect.bisect(kept_angles, angle_deg)
+                # kept_angles[i - 1] wraps to the last pin, so both neighbours
+                # are found around the seam as well
+                neighbours = (
+                    [kept_angles[i - 1], kept_angles[i % len(kept_angles)]] if kept_angles else []
+                )
+                distances = [abs(angle_deg - other) for other in neighbours]
+                if any(min(d, 360.0 - d) < self.min_note_angle_spacing for d in distances):
+                    keep[position] = False
+                else:
+                    kept_angles.insert(i, angle_deg)
 
-            angle_deg = (time_sec / self.cassette_rotation_seconds) * 360.0
+        return keep
 
-            if note_name in last_note_angle:
-                prev_angle = last_note_angle[note_name]
-                if abs(angle_deg - prev_angle) < self.min_note_angle_spacing:
-                    # Too close in angle for the same note, skip
-                    continue
+    def _pin_placements(self):
+        """
+        Computes where every pin goes, without building any geometry: one
+        NumPy pass over all events followed by the spacing filter.
 
-            note_index = self.tine_notes.index(note_name)
-            spacing_offset = self.tine_width * note_index
-            z_pin_center = z_min + spacing_offset + centre_offset
-            z_bottom = z_pin_center - (self.pin_height / 2.0)
+        Returns:
+            (angles_deg, x_centers, y_centers, z_bottoms) lists for the kept pins.
+        """
+        # Bottom of the pin for each tine, stacked up from the base ring
+        z_min = self.base_ring_height + self.pin_vertical_offset
+        centre_offset = self.pin_width / 2.0
+        z_bottoms = (
+            z_min + self.tine_width * np.arange(self.total_tines) + centre_offset - self.pin_height / 2.0
+        )
 
-            x_center = self.cassette_radius * math.cos(math.radians(angle_deg))
-            y_center = self.cassette_radius * math.sin(math.radians(angle_deg))
+        # Pin placement on the cassette surface for every event, in one pass
+        angles_deg = (self._times / self.cassette_rotation_seconds) * 360.0
+        keep = self._spaced_pin_mask(angles_deg)
+        angles_deg = angles_deg[keep]
+        angles_rad = np.deg2rad(angles_deg)
+        x_centers = self.cassette_radius * np.cos(angles_rad)
+        y_centers = self.cassette_radius * np.sin(angles_rad)
 
-            single_pin = (
-                cq.Workplane("XY")
-                .box(
-                    length=self.pin_radial_bump,
-                    width=self.pin_width,
-                    height=self.pin_height,
-                    centered=(False, True, False)
-                )
-                .rotate((0, 0, 0), (0, 0, 1), angle_deg)
-                .translate((x_center, y_center, z_bottom))
-            )
-            pins = pins.union(single_pin)
-            last_note_angle[note_name] = angle_deg
+        return (
+            angles_deg.tolist(), x_centers.tolist(), y_centers.tolist(),
+            z_bottoms[self._note_idx[keep]].tolist()
+        )
+
+    def _generate_pins_from_notes(self) -> cq.Workplane:
+        """
+        Create a set of pins based on note events, skipping overlapping pins
+        for the same note if they occur too close in angle.
+        """
+        if not len(self._times):
+            print("Warning: No notes detected to generate pins from.")
+            return cq.Workplane("XY").box(0.0001, 0.0001, 0.0001)
 
-        return pins
+        # Every pin is the same box, centred on y and sitting on z=0. As with
+        # the big cog teeth, build it once and place located instances of it
+        pin_prototype = cq.Solid.makeBox(
+            self.pin_radial_bump,
+            self.pin_width,
+            self.pin_height,
+            pnt=cq.Vector(0, -self.pin_width / 2.0, 0)
+        )
+        pin_solids = [
+            pin_prototype.moved(cq.Location(
+                cq.Vector(x_center, y_center, z_bottom), cq.Vector(0, 0, 1), angle_deg
+            ))
+            for angle_deg, x_center, y_center, z_bottom in zip(*self._pin_placements())
+        ]
+
+        # One compound of all pins, so the cassette body is fused with every
+        # pin in a single boolean rather than one union per pin
+        return cq.Workplane("XY").newObject([cq.Compound.makeCompound(pin_solids)])
 
     def _build_cassette(self) -> cq.Workplane:
         base_ring = self._make_base_ring()
         cassette_body = self._make_cassette_body()
-        wheel_with_pins_and_base = cassette_body.union(self._pins).union(base_ring)
         top_assembly = self._make_top_assembly()
-        return wheel_with_pins_and_base.union(top_assembly)
+
+        parts = [cassette_body.val(), self._pins.val(), base_ring.val(), top_assembly.val()]
+        if not self.fuse:
+            return cq.Workplane("XY").newObject([cq.Compound.makeCompound(parts)])
+
+        # The parts never overlap, they only touch (the pins only along lines,
+        # so they stay separate solids), so fuse them all in one glued boolean
+        # (run in parallel by OCCT)
+        cassette = parts[0].fuse(*parts[1:], glue=True).clean()
+        return cq.Workplane("XY").newObject([cassette])
 
     def _make_base_ring(self) -> cq.Workplane:
+        # Two concentric circles extrude as an annulus, no boolean cut needed
         return (
             cq.Workplane("XY")
             .circle(self.base_ring_od / 2.0)
+            .circle(self.base_ring_id / 2.0)
             .extrude(self.base_ring_height)
-            .cut(
-                cq.Workplane("XY")
-                .circle(self.base_ring_id / 2.0)
-                .extrude(self.base_ring_height)
-            )
         )
 
     def _make_cassette_body(self) -> cq.Workplane:
-        outer_cylinder = (
-            cq.Workplane("XY")
-            .workplane(offset=self.base_ring_height)
-            .circle(self.cassette_radius)
-            .extrude(self.cassette_total_height)
+        # The body is a tube whose bore has a tapered opening at the bottom.
+        # It is axisymmetric, so it is revolved from the wall's cross-section
+        # in one operation, with no boolean cut of the bore from a cylinder
+        z_start = self.base_ring_height
+        z_end = z_start + self.cassette_total_height
+        return (
+            cq.Workplane("XZ")
+            .polyline([
+                (self.interior_radius_opening, z_start),
+                (self.cassette_radius, z_start),
+                (self.cassette_radius, z_end),
+                (self.interior_radius, z_end),
+                (self.interior_radius, z_start + self.taper_height)
+            ])
+            .close()
+            .revolve(360, (0, 0, 0), (0, 1, 0))
         )
 
-        inner_cut = (
-            cq.Workplane("XY")
-            .workplane(offset=self.base_ring_height)
-            .circle(self.interior_radius_opening)
-            .workplane(offset=self.taper_height)
-            .circle(self.interior_radius)
-            .loft()
-            .faces(">Z")
-            .workplane()
-            .circle(self.interior_radius)
-            .extrude(self.cassette_total_height - self.taper_height)
+    def _make_top_assembly(self) -> cq.Workplane:
+        # The cogs are the slowest part of the build and identical for every
+        # song, so they are reused from the cache when available
+        params = {name: getattr(self, name) for name in TOP_ASSEMBLY_PARAMS}
+        top_assembly = cached_solid(
+            "top_assembly", params, lambda: self._build_top_assembly().val(), __file__,
+            use_cache=self._use_cache
         )
+        return cq.Workplane("XY").newObject([top_assembly])
 
-        return outer_cylinder.cut(inner_cut)
-
-    def _make_top_assembly(self) -> cq.Workplane:
+    def _build_top_assembly(self) -> cq.Workplane:
         # Add the flush offset to our calculations since we offset the small cog
         flush_offset = 0.5
 
@@ -231,7 +427,11 @@ class CassetteCAD:
             .extrude(self.top_circle_height)
         )
 
-        return lower_circle.union(big_cog).union(small_cog).union(top_circle)
+        # One N-ary fuse rather than a chain of unions, each of which would
+        # re-intersect the growing result (and clean it) again. Not glued: the
+        # small cog is sunk into the big cog by flush_offset, so they overlap
+        top_assembly = lower_circle.val().fuse(big_cog.val(), small_cog.val(), top_circle.val()).clean()
+        return cq.Workplane("XY").newObject([top_assembly])
 
     def _make_big_cog(self, z_start: float) -> cq.Workplane:
         big_cog_base_radius = self.big_cog_base_diam / 2.0
@@ -245,29 +445,28 @@ class CassetteCAD:
             .extrude(self.big_cog_height)
         )
 
-        big_cog_teeth = cq.Workplane("XY")
-        for i in range(self.big_cog_num_teeth):
-            angle_deg = i * (360.0 / self.big_cog_num_teeth)
-            angle_rad = math.radians(angle_deg)
-            tooth_3d = self._make_big_cog_tooth(
-                radial_thickness=big_cog_radial_thick,
-                base_width=1.0,
-                tip_width=0.4,
-                tooth_height=self.big_cog_height,
-                fillet_3d=0.1
-            )
-            tooth_3d = (
-                tooth_3d
-                .rotate((0, 0, 0), (0, 0, 1), angle_deg)
-                .translate((
-                    big_cog_base_radius * math.cos(angle_rad),
-                    big_cog_base_radius * math.sin(angle_rad),
-                    z_start
-                ))
-            )
-            big_cog_teeth = big_cog_teeth.union(tooth_3d)
-
-        return big_cog_base.union(big_cog_teeth)
+        # Every tooth is identical, so build (and fillet) it once, stand it on
+        # the base's rim and place located instances of it around the cog as a
+        # polar array; moved() only attaches a transform, the instances share
+        # the prototype's geometry
+        tooth_prototype = self._make_big_cog_tooth(
+            radial_thickness=big_cog_radial_thick,
+            base_width=1.0,
+            tip_width=0.4,
+            tooth_height=self.big_cog_height,
+            fillet_3d=0.1
+        ).val().moved(cq.Location(cq.Vector(big_cog_base_radius, 0, z_start)))
+
+        angles_deg = np.arange(self.big_cog_num_teeth) * (360.0 / self.big_cog_num_teeth)
+        tooth_solids = [
+            tooth_prototype.moved(cq.Location(cq.Vector(0, 0, 0), cq.Vector(0, 0, 1), angle_deg))
+            for angle_deg in angles_deg.tolist()
+        ]
+
+        # Teeth never overlap each other or the base's interior, so a single
+        # glued fuse of the whole set replaces one union per tooth
+        big_cog_teeth = cq.Workplane("XY").newObject([cq.Compound.makeCompound(tooth_solids)])
+        return big_cog_base.union(big_cog_teeth, glue=True)
 
     def _make_big_cog_tooth(
         self,
@@ -277,18 +476,20 @@ class CassetteCAD:
         tooth_height: float,
         fillet_3d: float
     ) -> cq.Workplane:
+        # Rounding the profile's corners before extruding gives the same solid
+        # as filleting its vertical edges, without a 3D fillet solve
         shape_2d = (
-            cq.Workplane("XY")
-            .polyline([
+            cq.Sketch()
+            .polygon([
                 (0, -base_width / 2.0),
                 (0,  base_width / 2.0),
                 (radial_thickness,  tip_width / 2.0),
                 (radial_thickness, -tip_width / 2.0)
             ])
-            .close()
+            .vertices()
+            .fillet(fillet_3d)
         )
-        tooth_3d = shape_2d.extrude(tooth_height)
-        return tooth_3d.edges("|Z").fillet(fillet_3d)
+        return cq.Workplane("XY").placeSketch(shape_2d).extrude(tooth_height)
 
     def _make_small_cog(self, z_start: float) -> cq.Workplane:
         # These offsets are tweaks to get our bevel gear right
@@ -299,6 +500,10 @@ class CassetteCAD:
 
         module = (self.small_cog_teeth_diam + tooth_offset) / (self.small_cog_num_teeth + 2)
 
+        # Imported here since the small cog is usually served from the solid
+        # cache, and then cq_gears is never needed
+        import cq_gears
+
         # Create the bevel gear
         gear = cq_gears.BevelGear(
             module=module,
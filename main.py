@@ -5,12 +5,7 @@ CLI interface for generating music box parts from MP3 files or text descriptions
 
 import click
 from pathlib import Path
-from note_extractor import extract_notes_from_mp3
-from note_player import simulate_notes
-from cassette import CassetteCAD
-from spindle import SpindleCAD
 from mechanism import ROTATION_TIME
-from ai_note_builder import get_notes_from_text
 
 @click.command()
 @click.option('--input-file', '-i', type=click.Path(exists=True),
@@ -19,11 +14,17 @@ from ai_note_builder import get_notes_from_text
               help='Name or description of the song to generate notes for')
 @click.option('--output-dir', '-o', default='stl',
               help='Output directory for STL files (default: stl/)')
-@click.option('--simulate/--no-simulate', default=True,
-              help='Whether to simulate playing the tune.')
+@click.option('--simulate/--no-simulate', default=False,
+              help='Whether to simulate playing the tune (default: off).')
 @click.option('--squeeze-time', '-t', type=float,
               help=f'Extract this many seconds from the MP3 and squeeze into cassette rotation time')
-def main(input_file: str, input_text: str, output_dir: str, simulate: bool, squeeze_time: float):
+@click.option('--cache/--no-cache', default=True,
+              help='Whether to reuse cached AI responses for --input-text and cached CAD solids and STL exports.')
+@click.option('--fuse/--no-fuse', default=True,
+              help='Whether to fuse the cassette parts that share faces (slower). Pins and cog teeth '
+                   'touch the cylinders only along lines, so either way the STL holds separate touching solids.')
+def main(input_file: str, input_text: str, output_dir: str, simulate: bool, squeeze_time: float, cache: bool,
+         fuse: bool):
     """
     Generate music box parts from either an MP3 file or a text description.
     """
@@ -36,26 +37,35 @@ def main(input_file: str, input_text: str, output_dir: str, simulate: bool, sque
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
 
+    # The audio, AI and CAD modules take seconds to import, so they are only
+    # imported once the arguments are known to be valid and only if needed
+    from cassette import CassetteCAD
+    from spindle import SpindleCAD
+
     # Get notes either from MP3 or AI
     if input_file:
+        from note_extractor import extract_notes_from_mp3
         note_events = extract_notes_from_mp3(
             input_file, 
             max_time=squeeze_time if squeeze_time else ROTATION_TIME,
             squeeze_to_duration=ROTATION_TIME if squeeze_time else None
         )
     else:
-        note_events = get_notes_from_text(input_text, ROTATION_TIME)
+        from ai_note_builder import get_notes_from_text
+        note_events = get_notes_from_text(input_text, ROTATION_TIME, use_cache=cache)
 
     # Build cassette geometry
-    cassette_cad = CassetteCAD(note_events=note_events, rotation_duration=ROTATION_TIME)
+    cassette_cad = CassetteCAD(note_events=note_events, rotation_duration=ROTATION_TIME, fuse=fuse,
+                               use_cache=cache)
     cassette_cad.export(str(output_path / "cassette.stl"))
 
     # Build spindle
-    spindle_cad = SpindleCAD()
+    spindle_cad = SpindleCAD(use_cache=cache)
     spindle_cad.export(str(output_path / "spindle.stl"))
 
     # Optional real-time playback simulation
     if simulate and note_events:
+        from note_player import simulate_notes
         print("\nSimulating cassette playback...")
         simulate_notes(note_events, total_duration=ROTATION_TIME)
 
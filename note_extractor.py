@@ -4,13 +4,25 @@ Extracts and filters note events from an MP3 file.
 """
 
 import math
+import subprocess
+from functools import lru_cache
 import numpy as np
 import aubio
+from numpy.lib.stride_tricks import sliding_window_view
 from pydub import AudioSegment
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, sosfiltfilt
 from tine import Tine
 
 
+# Rate the audio is decoded at, whatever the source file uses
+DECODE_SAMPLE_RATE = 44100
+
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F",
+              "F#", "G", "G#", "A", "A#", "B"]
+_NOTE_NAMES_ARRAY = np.array(NOTE_NAMES)
+
+
+@lru_cache(maxsize=256)
 def freq_to_note_name(freq: float) -> str:
     """
     Approximate frequency -> note name (A4=440Hz) with a chromatic scale.
@@ -22,13 +34,72 @@ def freq_to_note_name(freq: float) -> str:
     midi_num = 69 + 12 * math.log2(freq / 440.0)
     midi_rounded = int(round(midi_num))
 
-    note_names = ["C", "C#", "D", "D#", "E", "F",
-                  "F#", "G", "G#", "A", "A#", "B"]
-    name = note_names[midi_rounded % 12]
+    name = NOTE_NAMES[midi_rounded % 12]
     octave = (midi_rounded // 12) - 1
     return f"{name}{octave}"
 
 
+def freqs_to_note_names(freqs: np.ndarray) -> list:
+    """
+    Vectorised freq_to_note_name for a whole array of frequencies.
+    Invalid (non-positive) frequencies map to None.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    valid = freqs > 0
+    midi = np.rint(69 + 12 * np.log2(np.where(valid, freqs, 440.0) / 440.0)).astype(np.int64)
+    names = np.char.add(_NOTE_NAMES_ARRAY[midi % 12], (midi // 12 - 1).astype(str))
+    return [name if ok else None for name, ok in zip(names.tolist(), valid.tolist())]
+
+
+def _select_stable_onsets(
+    p1: np.ndarray,
+    p2: np.ndarray,
+    onsets: np.ndarray,
+    history_size: int = 3,
+    std_threshold: float = 9.0
+):
+    """
+    Vectorised pitch/onset gating over all frames at once.
+
+    The two pitch estimates are averaged when they agree (p1 is used alone
+    when they differ by more than 50Hz), then a frame is kept if it is an
+    onset and the last history_size pitches have a stddev below std_threshold.
+
+    Returns:
+        (frame_indices, avg_pitches) for the surviving frames.
+    """
+    pitches = np.where(np.abs(p1 - p2) > 50, p1, (p1 + p2) / 2)
+    if len(pitches) < history_size:
+        return np.empty(0, dtype=int), np.empty(0)
+
+    # Row k of the window view holds the history ending at frame k + history_size - 1
+    history = sliding_window_view(pitches, history_size)
+    avg = history.mean(axis=1)
+    std = history.std(axis=1)
+
+    stable = onsets[history_size - 1:] & (std < std_threshold)
+    rows = np.flatnonzero(stable)
+    return rows + (history_size - 1), avg[rows]
+
+
+def _decode_audio(mp3_path: str, max_time: float) -> np.ndarray:
+    """
+    Decode the first max_time seconds of an audio file to mono float32 samples
+    at DECODE_SAMPLE_RATE, piped straight out of ffmpeg (the decoder pydub
+    uses) rather than through a temporary WAV file and int16 samples.
+    """
+    command = [
+        AudioSegment.converter, "-v", "error",
+        "-t", str(max_time), "-i", mp3_path,
+        "-f", "f32le", "-ac", "1", "-ar", str(DECODE_SAMPLE_RATE), "pipe:1"
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        message = result.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"ffmpeg could not decode '{mp3_path}': {message}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
 def extract_notes_from_mp3(
     mp3_path: str,
     max_time: float = 20.0,
@@ -55,23 +126,20 @@ def extract_notes_from_mp3(
     # Load and clamp to max_time
     print(f"Loading {mp3_path}...")
     print(f"Max time: {max_time}s")
-    audio = AudioSegment.from_mp3(mp3_path)
-    audio = audio[: int(max_time * 1000)]
-
-    # Convert to mono, 16-bit PCM
-    if audio.channels > 1:
-        audio = audio.set_channels(1)
-    audio = audio.set_sample_width(2)
-    sr = audio.frame_rate
-    raw_data = np.frombuffer(audio._data, dtype=np.int16).astype(float)
-    raw_data = raw_data / np.max(np.abs(raw_data))
+    sr = DECODE_SAMPLE_RATE
+    raw_data = _decode_audio(mp3_path, max_time)
 
     # Bandpass filter to focus on typical fundamental frequencies
     nyquist = sr / 2
     low_cut = 60
     high_cut = 2000
-    b, a = butter(4, [low_cut/nyquist, high_cut/nyquist], btype='band')
-    raw_data = filtfilt(b, a, raw_data)
+    # Second-order sections are numerically stable for this narrow low band
+    sos = butter(4, [low_cut/nyquist, high_cut/nyquist], btype='band', output='sos')
+    # The filter is linear, so the peak normalisation is applied to its
+    # (float64) output rather than to a float64 copy of the decoded samples
+    filtered = sosfiltfilt(sos, raw_data)
+    filtered /= np.max(np.abs(raw_data))
+    raw_data = filtered.astype(np.float32)
 
     # Setup pitch and onset detectors
     frame_size = 512
@@ -87,44 +155,43 @@ def extract_notes_from_mp3(
     onset_detector = aubio.onset("complex", frame_size, hop_size, sr)
     onset_detector.set_threshold(onset_threshold)
 
-    # Prepare results
+    # Cast once and view the signal as (n_frames, frame_size) rows, so each
+    # frame handed to aubio is a contiguous float32 row with no per-frame copy
+    if len(raw_data) < frame_size:
+        # Too short for a single frame, so there is nothing to detect
+        frames = np.empty((0, frame_size), dtype=np.float32)
+    else:
+        frames = np.ascontiguousarray(
+            sliding_window_view(raw_data, frame_size)[:len(raw_data) - frame_size:hop_size]
+        )
+    frame_times = np.arange(len(frames)) * hop_size / sr
+    frames = frames[:np.searchsorted(frame_times, max_time, side='right')]
+
+    # The detectors are stateful, so they still see one frame at a time
+    p1 = np.empty(len(frames))
+    p2 = np.empty(len(frames))
+    onsets = np.empty(len(frames), dtype=bool)
+    for i, frame in enumerate(frames):
+        p1[i] = pitch_yinfft(frame)[0]
+        p2[i] = pitch_yin(frame)[0]
+        onsets[i] = onset_detector(frame)[0]
+
+    onset_indices, avg_pitches = _select_stable_onsets(
+        p1, p2, onsets, history_size=3, std_threshold=pitch_stability_threshold
+    )
+
+    # Only the (few) stable onsets need note mapping and bookkeeping
     note_events = []
     last_note_time = {}
-    pitch_history = []
-    history_size = 3
-    allowed_notes = set(Tine().notes)  # for quick membership checks
-
-    for start_idx in range(0, len(raw_data) - frame_size, hop_size):
-        frame = raw_data[start_idx : start_idx + frame_size].astype(np.float32)
-        frame_time = start_idx / sr
-        if frame_time > max_time:
-            break
-
-        # Pitch detection
-        p1 = pitch_yinfft(frame)[0]
-        p2 = pitch_yin(frame)[0]
-        pitch = p1 if abs(p1 - p2) > 50 else (p1 + p2) / 2
-
-        # Onset detection
-        is_onset = onset_detector(frame)[0]
-
-        # Rolling pitch history
-        pitch_history.append(pitch)
-        if len(pitch_history) > history_size:
-            pitch_history.pop(0)
-
-        if is_onset and len(pitch_history) == history_size:
-            avg_pitch = sum(pitch_history) / len(pitch_history)
-            std_pitch = np.std(pitch_history)
-
-            if std_pitch < pitch_stability_threshold:
-                note_name = freq_to_note_name(avg_pitch)
-                if note_name and note_name in allowed_notes:
-                    # Enforce a minimal time gap between repeats
-                    last_t = last_note_time.get(note_name, -min_time_between_notes)
-                    if (frame_time - last_t) >= min_time_between_notes:
-                        note_events.append((frame_time, note_name))
-                        last_note_time[note_name] = frame_time
+    allowed_notes = Tine.ALLOWED
+
+    for frame_time, note_name in zip(frame_times[onset_indices].tolist(), freqs_to_note_names(avg_pitches)):
+        if note_name and note_name in allowed_notes:
+            # Enforce a minimal time gap between repeats
+            last_t = last_note_time.get(note_name, -min_time_between_notes)
+            if (frame_time - last_t) >= min_time_between_notes:
+                note_events.append((frame_time, note_name))
+                last_note_time[note_name] = frame_time
 
     note_events.sort(key=lambda x: x[0])
 
@@ -5,10 +5,22 @@ Generates and plays 'music-box' tones for a given sequence of notes.
 
 import time
 import os
+from collections import Counter
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 import numpy as np
 import sounddevice as sd
+from scipy.signal import oaconvolve
+from cache import cache_path, write_atomically
 
+SAMPLE_RATE = 44100
 
+# Bump whenever generate_tone changes to invalidate cached tones
+TONE_VERSION = "v4"
+
+
+@lru_cache(maxsize=None)
 def note_to_freq(note_name: str) -> float:
     """
     Convert a note name (e.g. 'A4') to frequency in Hz (A4=440Hz reference).
@@ -20,41 +32,44 @@ def note_to_freq(note_name: str) -> float:
     return 440.0 * 2 ** ((octave - 4) + (semitone_index - 9) / 12)
 
 
-def generate_tone(freq: float, duration_ms: int = 250) -> np.ndarray:
-    """
-    Generate a music-box-like tone simulating a struck metal tine.
-    Returns raw audio samples.
-    """
-    sample_rate = 44100
-    num_samples = int(sample_rate * duration_ms / 1000)
-    t = np.arange(num_samples) / sample_rate
-
-    # Slightly stretched harmonics to simulate tine inharmonicity
-    harmonics = [
-        (1.000, 1.00),    # fundamental
-        (2.002, 0.75),    # slightly sharp octave (increased from 0.60)
-        (3.004, 0.35),    # slightly sharp twelfth (increased from 0.18)
-        (4.008, 0.15),    # slightly sharp double octave
-        (5.015, 0.08),    # upper harmonics increasingly sharp
-        (6.025, 0.05),
-        (7.040, 0.03),
-        (8.060, 0.02),
-    ]
+# Slightly stretched harmonics to simulate tine inharmonicity
+_HARMONIC_MULTS = np.array([
+    1.000,    # fundamental
+    2.002,    # slightly sharp octave
+    3.004,    # slightly sharp twelfth
+    4.008,    # slightly sharp double octave
+    5.015,    # upper harmonics increasingly sharp
+    6.025,
+    7.040,
+    8.060,
+])
+_HARMONIC_AMPS = np.array([
+    1.00,
+    0.75,     # increased from 0.60
+    0.35,     # increased from 0.18
+    0.15,
+    0.08,
+    0.05,
+    0.03,
+    0.02,
+], dtype=np.float32)
 
-    # Generate base waveform with inharmonic components
-    samples = np.zeros_like(t)
-    for mult, amp in harmonics:
-        # Add slight random phase variation for more natural sound
-        phase = np.random.uniform(0, 0.2)  # Increased phase variation
-        samples += amp * np.sin(2 * np.pi * freq * mult * t + phase)
+# Initial "ping" transient: 15ms, decaying the same way for every note
+_PING_T = (np.arange(int(0.015 * SAMPLE_RATE)) / SAMPLE_RATE).astype(np.float32)
+_PING_ENV = np.exp(-_PING_T * 150)
 
-    # Initial "ping" transient
-    ping_duration = int(0.015 * sample_rate)  # Increased to 15ms
-    ping_freq = freq * 3  # Reduced from 4x to 3x for less harsh attack
-    ping = np.sin(2 * np.pi * ping_freq * t[:ping_duration]) * np.exp(-t[:ping_duration] * 150)
-    samples[:ping_duration] += ping * 0.4
+# Decay of the resonance noise smoothing kernel
+_RESONANCE_KERNEL = np.exp(-np.linspace(0, 10, 1000)).astype(np.float32)
 
-    # More sophisticated envelope with longer decay
+
+@lru_cache(maxsize=None)
+def _envelope(num_samples: int) -> np.ndarray:
+    """
+    Amplitude envelope of a struck tine: a fast attack, a two-stage decay and a
+    gentle release. It only depends on the tone length, so it is built once
+    per length into a single buffer and returned read-only.
+    """
+    sample_rate = SAMPLE_RATE
     attack_ms = 3
     decay_1_ms = 40   # Initial quick decay
     decay_2_ms = 150  # Longer resonant decay
@@ -64,49 +79,107 @@ def generate_tone(freq: float, duration_ms: int = 250) -> np.ndarray:
     decay_1_samples = int(sample_rate * decay_1_ms / 1000)
     decay_2_samples = int(sample_rate * decay_2_ms / 1000)
     release_samples = int(sample_rate * release_ms / 1000)
-    
-    # Create envelope
-    envelope = np.ones(num_samples)
-    
-    # Fast but smooth attack
-    envelope[:attack_samples] = np.power(np.linspace(0, 1, attack_samples), 0.7)
-    
-    # Two-stage decay for more natural resonance
-    decay_1_curve = np.exp(-np.linspace(0, 2, decay_1_samples))  # Gentler initial decay
-    decay_2_curve = np.exp(-np.linspace(2, 3, decay_2_samples))  # Much gentler long decay
-    decay_curve = np.concatenate([decay_1_curve, decay_2_curve])
-    
-    decay_start = attack_samples
-    decay_end = min(decay_start + len(decay_curve), num_samples)
-    envelope[decay_start:decay_end] *= decay_curve[:decay_end-decay_start]
-    
-    # Gentle release
-    if num_samples > (decay_start + len(decay_curve)):
-        release_start = decay_start + len(decay_curve)
-        release_curve = np.exp(-np.linspace(3, 4, release_samples))
-        release_end = min(release_start + release_samples, num_samples)
-        envelope[release_start:release_end] *= release_curve[:release_end-release_start]
+
+    # Each stage is written straight into its slice; anything past the
+    # release stays at full level
+    envelope = np.ones(num_samples, dtype=np.float32)
+    stages = [
+        # Fast but smooth attack
+        np.power(np.linspace(0, 1, attack_samples), 0.7),
+        # Two-stage decay for more natural resonance
+        np.exp(-np.linspace(0, 2, decay_1_samples)),  # Gentler initial decay
+        np.exp(-np.linspace(2, 3, decay_2_samples)),  # Much gentler long decay
+        # Gentle release
+        np.exp(-np.linspace(3, 4, release_samples)),
+    ]
+    start = 0
+    for stage in stages:
+        end = min(start + len(stage), num_samples)
+        envelope[start:end] = stage[:end-start]
+        start = end
+
+    envelope.flags.writeable = False
+    return envelope
+
+
+def generate_tone(freq: float, duration_ms: int = 250) -> np.ndarray:
+    """
+    Generate a music-box-like tone simulating a struck metal tine.
+    Returns raw audio samples. The random phase and resonance noise are
+    seeded from the frequency, so a note always renders the same way.
+    """
+    rng = np.random.default_rng(round(freq * 1000))
+    sample_rate = SAMPLE_RATE
+    num_samples = int(sample_rate * duration_ms / 1000)
+    t = np.arange(num_samples, dtype=np.float32) / np.float32(sample_rate)
+
+    # Generate base waveform with inharmonic components: one broadcast sine over
+    # all harmonics, then a matrix-vector product for the weighted sum.
+    # Slight random phase variation per harmonic gives a more natural sound.
+    # The whole tone is rendered in float32, whose sine is several times
+    # faster and still far below audible error for a quarter-second tone
+    phases = rng.uniform(0, 0.2, len(_HARMONIC_MULTS)).astype(np.float32)
+    omegas = ((2 * np.pi * freq) * _HARMONIC_MULTS).astype(np.float32)
+    partials = np.multiply.outer(omegas, t)
+    partials += phases[:, None]
+    np.sin(partials, out=partials)
+    samples = _HARMONIC_AMPS @ partials
+
+    # Initial "ping" transient
+    ping_duration = min(len(_PING_T), num_samples)
+    ping_freq = freq * 3  # Reduced from 4x to 3x for less harsh attack
+    ping = np.sin(np.float32(2 * np.pi * ping_freq) * _PING_T[:ping_duration]) * _PING_ENV[:ping_duration]
+    samples[:ping_duration] += ping * np.float32(0.4)
+
+    # More sophisticated envelope with longer decay
+    envelope = _envelope(num_samples)
 
     # Apply envelope
     samples *= envelope
 
     # Add subtle resonant frequencies
-    resonance = np.random.normal(0, 0.0002, len(samples))
-    resonance = np.convolve(resonance, np.exp(-np.linspace(0, 10, 1000)), mode='same')
+    resonance = rng.normal(0, 0.0002, len(samples)).astype(np.float32)
+    resonance = np.convolve(resonance, _RESONANCE_KERNEL, mode='same')
     resonance *= envelope
     samples += resonance
 
     # Soft limiting to prevent harsh clipping while preserving dynamics
-    samples = np.tanh(samples * 0.8)
+    samples *= np.float32(0.8)
+    np.tanh(samples, out=samples)
     
-    return samples.astype(np.float32)
+    return samples
 
 
-def simulate_notes(note_events, total_duration: float):
+@lru_cache(maxsize=None)
+def _load_or_generate_tone(note_name: str, duration_ms: int = 250) -> np.ndarray:
+    """
+    Load a previously rendered tone from the on-disk cache, rendering and
+    caching it on first use. Tones are also kept in memory, so they are
+    returned read-only.
+    """
+    path = cache_path("tones", f"{note_name}_{SAMPLE_RATE}_{duration_ms}_{TONE_VERSION}.npy")
+    if path.exists():
+        tone = np.load(path)
+    else:
+        tone = generate_tone(note_to_freq(note_name), duration_ms)
+        write_atomically(path, lambda tmp_path: _save_tone(tmp_path, tone))
+    tone.flags.writeable = False
+    return tone
+
+
+def _save_tone(file_name: str, tone: np.ndarray):
+    # Saved through a file object, since np.save would append ".npy" to the
+    # temporary file's name
+    with open(file_name, "wb") as f:
+        np.save(f, tone)
+
+
+def simulate_notes(note_events, total_duration: float, verbose: bool = True):
     """
     Renders and plays the complete song.
     Each event is a tuple (time_in_sec, note_name).
     Supports simultaneous notes for chords.
+    If verbose, the notes are printed before playback starts.
     """
     if not note_events:
         print("No notes to simulate.")
@@ -115,52 +188,47 @@ def simulate_notes(note_events, total_duration: float):
     print("Simulating cassette playback...")
     
     # Audio settings
-    sample_rate = 44100
+    sample_rate = SAMPLE_RATE
     total_samples = int(sample_rate * total_duration)
     
     # Pre-render all unique notes
     unique_notes = sorted(set([evt[1] for evt in note_events]))
-    tone_map = {n: generate_tone(note_to_freq(n)) for n in unique_notes}
+    tone_map = {n: _load_or_generate_tone(n) for n in unique_notes}
     
     # Create full song buffer
     song_buffer = np.zeros(total_samples, dtype=np.float32)
     
-    # Group notes by time
-    time_grouped_notes = {}
-    for time, note in note_events:
-        sample_pos = int(time * sample_rate)
-        if sample_pos not in time_grouped_notes:
-            time_grouped_notes[sample_pos] = []
-        time_grouped_notes[sample_pos].append(note)
-    
-    # Mix all notes into the song buffer
-    for sample_pos, notes in sorted(time_grouped_notes.items()):
-        # Print chord or single note
-        if len(notes) > 1:
-            print(f"♪ [{' '.join(notes)}]", end=' ', flush=True)
-        else:
-            print(f"♪ {notes[0]}", end=' ', flush=True)
-            
-        # Mix notes that start at this position
-        chord_samples = np.zeros_like(tone_map[notes[0]])
-        for note in notes:
-            chord_samples += tone_map[note]
-        
-        # Normalize chord
-        chord_samples /= max(1.0, len(notes))
-        
-        # Add to song buffer
-        end_pos = min(sample_pos + len(chord_samples), total_samples)
-        song_buffer[sample_pos:end_pos] += chord_samples[:end_pos-sample_pos]
+    # Notes starting on the same sample form a chord, and each note of a chord
+    # is scaled down by the chord's size
+    positions = [int(time_sec * sample_rate) for time_sec, _ in note_events]
+    chord_sizes = Counter(positions)
+
+    # List every chord or single note, in time order, in a single write
+    if verbose:
+        events_by_position = sorted(zip(positions, (note for _, note in note_events)), key=itemgetter(0))
+        symbols = []
+        for _, chord in groupby(events_by_position, key=itemgetter(0)):
+            notes = [note for _, note in chord]
+            symbols.append(f"♪ [{' '.join(notes)}]" if len(notes) > 1 else f"♪ {notes[0]}")
+        print(' '.join(symbols), end=' ', flush=True)
+
+    # Mix each note straight into the song buffer
+    for sample_pos, (_, note) in zip(positions, note_events):
+        tone = tone_map[note]
+        end_pos = min(sample_pos + len(tone), total_samples)
+        if end_pos > sample_pos:
+            song_buffer[sample_pos:end_pos] += tone[:end_pos-sample_pos] / chord_sizes[sample_pos]
     
     # Optional: Add subtle reverb
     reverb_length = int(0.1 * sample_rate)  # 100ms reverb
     reverb = np.exp(-np.linspace(0, 4, reverb_length)).astype(np.float32)  # Force float32
-    song_buffer = np.convolve(song_buffer, reverb, mode='same').astype(np.float32)  # Force float32
+    # Overlap-add FFT convolution: the direct form is O(song x reverb) samples
+    song_buffer = oaconvolve(song_buffer, reverb, mode='same').astype(np.float32, copy=False)  # Force float32
     
-    # Final normalization
+    # Final normalization, in place so the buffer stays float32 without a copy.
+    # The whole song is rendered up front (tens of milliseconds) because both
+    # the reverb and the normalization need the complete signal
     song_buffer /= np.max(np.abs(song_buffer))
-    song_buffer = song_buffer.astype(np.float32)  # Ensure final buffer is float32
     
     # Play the complete song
     stream = sd.OutputStream(
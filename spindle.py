@@ -5,7 +5,14 @@ Generates a rod with a threaded section, a tapered tip, and a handle with wings.
 
 import cadquery as cq
 import math
-from cq_warehouse.thread import Thread
+from OCP.BOPAlgo import BOPAlgo_Options
+from OCP.OSD import OSD_Parallel
+from cache import cached_solid
+
+# Run OCCT booleans in parallel, as cassette.py does, so the rod gets them
+# even when it is built without the cassette module loaded
+BOPAlgo_Options.SetParallelMode_s(True)
+OSD_Parallel.SetUseOcctThreads_s(True)
 
 class SpindleCAD:
     """
@@ -16,12 +23,17 @@ class SpindleCAD:
       - Four rectangular wings
 
     Public Methods:
-        __init__(): Initializes the Spindle object and builds the geometry.
+        __init__(use_cache=True): Initializes the Spindle object and builds the geometry.
         export(filename: str): Exports the rod as an STL file.
         simulate(): Simulates rod usage (placeholder).
     """
 
-    def __init__(self):
+    def __init__(self, use_cache=True):
+        """
+        Args:
+            use_cache: If False, rebuild the rod instead of reading it from
+                the solid cache.
+        """
         # Taper dimensions
         self.taper_height = 2.0
         self.taper_diam_top = 5.0
@@ -56,8 +68,11 @@ class SpindleCAD:
         self.z_handle_start = self.z_thread_end
         self.z_handle_end   = self.z_handle_start + self.handle_height
 
-        # Build final rod geometry
-        self._assembly = self._build_rod()
+        # Build final rod geometry. It only depends on the dimensions above,
+        # so after the first run it is read back from the solid cache
+        params = {name: value for name, value in vars(self).items() if isinstance(value, (int, float))}
+        rod = cached_solid("spindle", params, lambda: self._build_rod().val(), __file__, use_cache=use_cache)
+        self._assembly = cq.Workplane("XY").newObject([rod])
 
     def export(self, filename: str):
         """
@@ -86,6 +101,10 @@ class SpindleCAD:
         )
 
     def _make_threaded_portion(self) -> cq.Workplane:
+        # Imported here since the rod is usually served from the solid cache,
+        # and then cq_warehouse is never needed
+        from cq_warehouse.thread import Thread
+
         # Create external thread surface
         my_thread = Thread(
             apex_radius=self.thread_apex_radius,
@@ -118,20 +137,24 @@ class SpindleCAD:
         )
 
     def _make_wings(self) -> cq.Workplane:
-        wings_3d = cq.Workplane("XY")
-
-        for i in range(self.wing_count):
-            angle_deg = i * (360.0 / self.wing_count)
-            # Create the basic wing shape
-            single_wing_2d = cq.Workplane("XY").rect(self.wing_radial_len, self.wing_width, centered=True)
-            single_wing_3d = single_wing_2d.extrude(self.wing_height)
-            
-            # Add fillets to all edges to make it comfortable to handle
-            single_wing_3d = single_wing_3d.edges().fillet(self.handle_fillet_radius)
-            
-            # Position and rotate the wing
-            single_wing_3d = single_wing_3d.translate((self.handle_diam / 2, 0.0, self.z_handle_start))
-            single_wing_3d = single_wing_3d.rotate((0, 0, 0), (0, 0, 1), angle_deg)
-            wings_3d = wings_3d.union(single_wing_3d)
-
-        return wings_3d
\ No newline at end of file
+        # Every wing is identical, so build and fillet one (all edges, to make
+        # it comfortable to handle), stand it on the handle's rim and place
+        # rotated instances of it, rather than filleting each wing separately
+        wing_prototype = (
+            cq.Workplane("XY")
+            .rect(self.wing_radial_len, self.wing_width, centered=True)
+            .extrude(self.wing_height)
+            .edges()
+            .fillet(self.handle_fillet_radius)
+            .val()
+            .moved(cq.Location(cq.Vector(self.handle_diam / 2, 0.0, self.z_handle_start)))
+        )
+
+        wing_solids = [
+            wing_prototype.moved(cq.Location(cq.Vector(0, 0, 0), cq.Vector(0, 0, 1), i * (360.0 / self.wing_count)))
+            for i in range(self.wing_count)
+        ]
+
+        # The rounded wings do not touch each other, so they are kept as one
+        # compound and fused with the rest of the rod
+        return cq.Workplane("XY").newObject([cq.Compound.makeCompound(wing_solids)])